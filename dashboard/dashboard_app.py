@@ -21,17 +21,18 @@ def index():
 def dashboard_summary():
     """Aggregate data for carbon-aware dashboard with IST timezone."""
     try:
-        # Fetch data from ingestion API
-        carbon_summary = requests.get(f'{API_BASE_URL}/api/v1/carbon/summary').json()
-        by_device = requests.get(f'{API_BASE_URL}/api/v1/carbon/by-device').json()
-        by_hour = requests.get(f'{API_BASE_URL}/api/v1/carbon/by-hour').json()
-        stats = requests.get(f'{API_BASE_URL}/api/v1/stats').json()
+        # Fetch data from ingestion API (all four queries run concurrently server-side)
+        carbon = requests.get(f'{API_BASE_URL}/api/v1/dashboard').json()
+
+        # Pass the API's own error through rather than failing on a missing key
+        if 'error' in carbon:
+            return jsonify({'error': carbon['error']}), 500
 
         return jsonify({
-            'carbon_summary': carbon_summary,
-            'by_device': by_device,
-            'by_hour': by_hour,
-            'system_stats': stats,
+            'carbon_summary': carbon['carbon_summary'],
+            'by_device': carbon['by_device'],
+            'by_hour': carbon['by_hour'],
+            'system_stats': carbon['system_stats'],
             'timezone': 'Asia/Kolkata (IST)',
             'current_time': datetime.now(IST).strftime('%H:%M:%S IST')
         })
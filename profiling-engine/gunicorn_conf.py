@@ -0,0 +1,28 @@
+"""
+Gunicorn settings for the ingestion API.
+
+Run with: gunicorn --config gunicorn_conf.py ingestion_api:app
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Each worker opens API_THREADS Postgres connections up front and can grow
+# to API_THREADS + 8 (the dashboard fan-out), i.e. 16-24 per worker and
+# 32-48 per pod with the defaults. (replicas + rollout surge) x workers x 24
+# has to fit under Postgres max_connections (set to 200 in all-in-one.yaml);
+# scale with replicas rather than 2*cpu+1 workers per pod
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+worker_class = 'gthread'
+threads = int(os.environ.get('API_THREADS', '16'))
+timeout = 120
+keepalive = 30
+
+# Import the app once in the master and fork workers from it, so the
+# forecast model is loaded a single time and shared copy-on-write. The DB
+# pool is created lazily inside each worker, so no connection crosses a fork.
+preload_app = True
+# Tells ingestion_api to load the model synchronously at import (before the
+# fork) instead of from a background thread, which would not survive it
+os.environ.setdefault('ML_MODEL_PRELOAD', '1')
@@ -1,12 +1,20 @@
 from flask import Flask, request, jsonify
-from datetime import datetime, timedelta
+from flask.json.provider import JSONProvider
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+from heapq import nsmallest
+from operator import itemgetter
 from zoneinfo import ZoneInfo
-import json
+import io
+import orjson
 import os
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import connection as PGConnection
+from psycopg2.pool import ThreadedConnectionPool
+import threading
 import time
-from prophet import Prophet
 import pickle
 from pathlib import Path
 import pandas as pd
@@ -16,35 +24,314 @@ import warnings
 warnings.filterwarnings('ignore')
 
 
+def orjson_default(obj):
+    """Serialize types orjson does not handle natively."""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (native datetime and numpy support)."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(
+            obj,
+            default=orjson_default,
+            option=orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY
+        ).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # Indian Standard Time
 IST = ZoneInfo("Asia/Kolkata")
 
+# to_char() pattern equivalent to datetime.isoformat() for IST session timestamps
+ISO_TIMESTAMP_FORMAT = 'YYYY-MM-DD"T"HH24:MI:SS.USOF'
+
 DB_CONFIG = {
     'host': os.environ.get('DB_HOST', 'postgres-service'),
     'port': os.environ.get('DB_PORT', '5432'),
     'database': os.environ.get('DB_NAME', 'carbon_metrics'),
     'user': os.environ.get('DB_USER', 'carbon_user'),
-    'password': os.environ.get('DB_PASSWORD', 'carbon_pass_123')
+    'password': os.environ.get('DB_PASSWORD', 'carbon_pass_123'),
+    # Sent in the startup packet, so every session is IST without a SET roundtrip.
+    # JIT is off: API statements are short OLTP queries where LLVM compile time
+    # dwarfs execution (the worker's heavy view refreshes keep the default)
+    'options': '-c timezone=Asia/Kolkata -c jit=off'
 }
 
+# Connections returned while more than DB_POOL_MIN are idle get closed by
+# psycopg2's pool, so keep the floor at the worker's request thread count.
+# The ceiling is what one process can actually hold at once: one connection
+# per request thread plus one per dashboard fan-out thread.
+API_THREADS = int(os.environ.get('API_THREADS', '16'))
+QUERY_EXECUTOR_WORKERS = 8
+DB_POOL_MIN = API_THREADS
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', str(API_THREADS + QUERY_EXECUTOR_WORKERS)))
+db_pool = None
+db_pool_lock = threading.Lock()
+
 ML_MODEL_PATH = Path("./models/grid_prophet.pkl")
+# Hour-of-year forecast table precomputed by train_model.py; preferred over
+# running Prophet, which stays as the fallback when the table is absent
+FORECAST_TABLE_PATH = Path("./models/grid_forecast_table.npy")
+forecast_table = None
 ml_model = None
 ml_model_error = None
+ml_model_lock = threading.Lock()
+
+# The hourly forecast only changes when the hour rolls over
+forecast_cache = {'key': None, 'value': None}
+forecast_cache_lock = threading.Lock()
+
+# Streaming limits for per-device detail responses
+MAX_DETAIL_LIMIT = 10000
+STREAM_ITERSIZE = 500
+
+# Batches at least this large are staged with COPY instead of one JSON parameter
+COPY_BATCH_THRESHOLD = 1000
+
+# Short-lived cache for the full-table aggregate endpoints
+response_cache = {}
+RESPONSE_CACHE_TTL_SECONDS = 15
+HEALTH_CACHE_TTL_SECONDS = 5
+
+# Fans independent dashboard queries out over separate connections
+query_executor = ThreadPoolExecutor(max_workers=QUERY_EXECUTOR_WORKERS)
 
 def get_db_connection():
-    return psycopg2.connect(**DB_CONFIG)
+    """
+    Open an autocommit connection.
+
+    Every statement the API issues is self-contained (ingest is a single
+    CTE), so autocommit saves the BEGIN and COMMIT roundtrips psycopg2
+    would otherwise wrap around each one.
+    """
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    return conn
+
+class PreparingConnection(PGConnection):
+    """Connection that remembers which statements it has PREPAREd."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+def get_db_pool() -> ThreadedConnectionPool:
+    """Create the connection pool on first use, i.e. per process after any fork."""
+    global db_pool
+    if db_pool is None:
+        with db_pool_lock:
+            if db_pool is None:
+                db_pool = ThreadedConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX,
+                    connection_factory=PreparingConnection, **DB_CONFIG
+                )
+    return db_pool
+
+def acquire_db_connection():
+    """Borrow an autocommit connection from the pool."""
+    conn = get_db_pool().getconn()
+    conn.autocommit = True
+    return conn
+
+def release_db_connection(conn):
+    """Return a borrowed connection, ending any transaction left open."""
+    if not conn.closed:
+        conn.rollback()
+    get_db_pool().putconn(conn)
+
+@contextmanager
+def db_cursor():
+    """Yield a cursor on a pooled connection, committing or rolling back on exit."""
+    conn = acquire_db_connection()
+    try:
+        with conn.cursor() as cur:
+            yield cur
+        conn.commit()
+    finally:
+        # Rolls back whatever an exception left uncommitted
+        release_db_connection(conn)
+
+def execute_prepared(cur, name: str, sql: str, params=()):
+    """
+    Run `sql` (with $1..$n placeholders) as the prepared statement `name`.
+
+    The first use on each pooled connection sends PREPARE; after that only
+    EXECUTE goes over the wire, skipping the parse and plan steps. Prepared
+    statements are session-level and survive rollbacks, so the per-connection
+    record stays accurate for the connection's lifetime.
+    """
+    conn = cur.connection
+    if name not in conn.prepared_statements:
+        cur.execute(f"PREPARE {name} AS {sql}")
+        conn.prepared_statements.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
+def open_stream_cursor(name: str, sql: str, params=None):
+    """
+    Run `sql` on a named (server-side) cursor over a pooled connection.
+
+    Rows stay server-side and are fetched STREAM_ITERSIZE at a time.
+    Returns (conn, cur, first_row); first_row is None for an empty result.
+    """
+    conn = acquire_db_connection()
+    try:
+        # Named cursors only live inside a transaction
+        conn.autocommit = False
+        cur = conn.cursor(name=name)
+        cur.itersize = STREAM_ITERSIZE
+        cur.execute(sql, params)
+        first = cur.fetchone()
+    except Exception:
+        release_db_connection(conn)
+        raise
+    return conn, cur, first
+
+def close_stream_cursor(conn, cur):
+    """Close a streaming cursor and hand its connection back to the pool."""
+    cur.close()
+    release_db_connection(conn)
+
+def stream_rows_response(conn, cur, first, prefix: bytes, count_key: str):
+    """
+    Stream the cursor's rows as a JSON array without materializing them.
+
+    `prefix` opens the response object up to and including the array's '[';
+    the object is closed with the row count under `count_key`. The
+    connection stays borrowed until the server has finished sending.
+    """
+    def generate():
+        yield prefix
+        count = 0
+        if first is not None:
+            # Named cursors only describe their columns after the first fetch
+            columns = [column.name for column in cur.description]
+            yield orjson.dumps(dict(zip(columns, first)))
+            count = 1
+            for record in cur:
+                yield b',' + orjson.dumps(dict(zip(columns, record)))
+                count += 1
+        yield b'],' + orjson.dumps(count_key) + b':' + str(count).encode() + b'}'
+
+    response = app.response_class(generate(), mimetype='application/json')
+    response.call_on_close(lambda: close_stream_cursor(conn, cur))
+    return response
+
+def get_cached_response(key: str, ttl: float = RESPONSE_CACHE_TTL_SECONDS):
+    """Return a cached response payload if it is still fresh."""
+    cached = response_cache.get(key)
+    if cached and time.monotonic() - cached['timestamp'] < ttl:
+        return cached['value']
+    return None
+
+def set_cached_response(key: str, value):
+    response_cache[key] = {
+        'value': value,
+        'timestamp': time.monotonic()
+    }
+
+# Every table and index init_database() creates; DDL is skipped when all of
+# them exist, every index among them is valid, and the device_metrics_notify
+# trigger exists
+SCHEMA_OBJECTS = (
+    'device_metrics',
+    'idx_device_id',
+    'idx_timestamp',
+    'idx_location',
+    'idx_metrics_dev_country',
+    'idx_metrics_unprocessed',
+    'device_application_samples',
+    'idx_app_samples_metric',
+    'idx_app_samples_name',
+)
+
+# Rows marked per statement when backfilling device_metrics.processed
+PROCESSED_BACKFILL_BATCH_SIZE = 10000
+
+def backfill_processed_flags(cur):
+    """
+    Mark metrics the worker profiled before the processed flag existed.
+
+    Walks carbon_footprints by primary key in batches, each its own
+    autocommit statement, so no long lock is held on device_metrics.
+    Idempotent, so an interrupted migration simply reruns it.
+    """
+    last_id = 0
+    while True:
+        cur.execute("""
+            WITH chunk AS (
+                SELECT id, metric_id FROM carbon_footprints
+                WHERE id > %s ORDER BY id LIMIT %s
+            ), marked AS (
+                UPDATE device_metrics m SET processed = TRUE
+                FROM chunk
+                WHERE m.id = chunk.metric_id AND NOT m.processed
+            )
+            SELECT max(id) FROM chunk
+        """, (last_id, PROCESSED_BACKFILL_BATCH_SIZE))
+        last_id = cur.fetchone()[0]
+        if last_id is None:
+            return
 
 def init_database():
-    max_retries = 10
+    """
+    Create tables and indexes.
+
+    Indexes are built CONCURRENTLY so schema changes on a live database do
+    not block ingest; that needs the autocommit connection from
+    get_db_connection().
+    """
+    max_retries = 15
     for attempt in range(max_retries):
         try:
             conn = get_db_connection()
             cur = conn.cursor()
 
-            # Set timezone to IST for this connection
-            cur.execute("SET timezone = 'Asia/Kolkata'")
+            # One catalog lookup instead of re-issuing every DDL statement per
+            # deploy. An interrupted CREATE INDEX CONCURRENTLY leaves an
+            # INVALID index behind, which does not count as present.
+            cur.execute(
+                """
+                SELECT bool_and(
+                           to_regclass(name) IS NOT NULL
+                           AND NOT EXISTS (
+                               SELECT 1 FROM pg_index
+                               WHERE indexrelid = to_regclass(name) AND NOT indisvalid
+                           )
+                       )
+                       AND EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'device_metrics_notify')
+                FROM unnest(%s::text[]) AS name
+                """,
+                (list(SCHEMA_OBJECTS),)
+            )
+            if cur.fetchone()[0]:
+                cur.close()
+                conn.close()
+                print("Database schema already up to date (Timezone: Asia/Kolkata)")
+                return
+
+            # IF NOT EXISTS would keep an INVALID index, so drop those to rebuild them below
+            cur.execute(
+                """
+                SELECT name
+                FROM unnest(%s::text[]) AS name
+                JOIN pg_index ON indexrelid = to_regclass(name)
+                WHERE NOT indisvalid
+                """,
+                (list(SCHEMA_OBJECTS),)
+            )
+            for (index_name,) in cur.fetchall():
+                print(f"Rebuilding invalid index {index_name}")
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
 
             # Main metrics table with location
             cur.execute("""
@@ -67,203 +354,529 @@ def init_database():
                     memory_percent FLOAT,
                     total_power_watts FLOAT,
                     cpu_count INTEGER,
+                    -- Raw payload only; deliberately not GIN-indexed, query
+                    -- per-app data through device_application_samples
                     applications JSONB,
 
                     created_at TIMESTAMPTZ DEFAULT NOW()
                 )
             """)
 
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_device_id ON device_metrics(device_id)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON device_metrics(timestamp)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_location ON device_metrics(latitude, longitude)")
+            cur.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_device_id ON device_metrics(device_id)")
+            cur.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_timestamp ON device_metrics(timestamp)")
+            cur.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_location ON device_metrics(latitude, longitude)")
+            cur.execute("""
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_metrics_dev_country
+                ON device_metrics(device_id, city, country) INCLUDE (timestamp)
+            """)
+
+            # Set by the profiling worker once a metric has a carbon footprint.
+            # The ADD COLUMN commits on its own (a constant default is a
+            # catalog-only change); the backfill then runs in short batches
+            # and, being keyed on the partial index not existing yet, reruns
+            # if a deploy is interrupted before the index is built.
+            cur.execute("ALTER TABLE device_metrics ADD COLUMN IF NOT EXISTS processed BOOLEAN NOT NULL DEFAULT FALSE")
+            cur.execute("""
+                SELECT to_regclass('idx_metrics_unprocessed') IS NULL
+                       AND to_regclass('carbon_footprints') IS NOT NULL
+            """)
+            if cur.fetchone()[0]:
+                backfill_processed_flags(cur)
+            cur.execute("""
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_metrics_unprocessed
+                ON device_metrics(timestamp) WHERE processed = FALSE
+            """)
+
+            # Per-application samples, normalized out of device_metrics.applications
+            # so per-app reports are plain relational queries on B-tree indexes
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS device_application_samples (
+                    metric_id INTEGER NOT NULL REFERENCES device_metrics(id) ON DELETE CASCADE,
+                    app_name TEXT,
+                    pid INTEGER,
+                    cpu_percent FLOAT,
+                    memory_percent FLOAT,
+                    power_watts FLOAT
+                )
+            """)
+
+            cur.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_app_samples_metric ON device_application_samples(metric_id)")
+            cur.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_app_samples_name ON device_application_samples(app_name)")
+
+            # Wakes the profiling worker (LISTEN new_metric) once per ingest statement
+            cur.execute("""
+                CREATE OR REPLACE FUNCTION notify_new_metric() RETURNS trigger
+                LANGUAGE plpgsql AS $$
+                BEGIN
+                    PERFORM pg_notify('new_metric', '');
+                    RETURN NULL;
+                END
+                $$
+            """)
+            cur.execute("""
+                CREATE OR REPLACE TRIGGER device_metrics_notify
+                AFTER INSERT ON device_metrics
+                FOR EACH STATEMENT EXECUTE FUNCTION notify_new_metric()
+            """)
 
-            conn.commit()
             cur.close()
             conn.close()
             print("Database initialized successfully (Timezone: Asia/Kolkata)")
             return
         except Exception as e:
             if attempt < max_retries - 1:
-                print(f"⏳ Waiting for database... ({attempt + 1}/{max_retries})")
-                time.sleep(3)
+                # Exponential backoff: the database is usually up within the first few tries
+                delay = min(0.2 * 2 ** attempt, 3)
+                print(f"⏳ Waiting for database... ({attempt + 1}/{max_retries}, retry in {delay:.1f}s)")
+                time.sleep(delay)
             else:
                 print(f"Failed to connect: {e}")
                 raise
 
-init_database()
+# Schema changes run once per deploy (k8s initContainer), not in every worker process
+if os.environ.get('RUN_MIGRATIONS') == '1':
+    init_database()
 
 
 def load_ml_model():
-    """Load Prophet model if available."""
-    global ml_model, ml_model_error
+    """Load the forecast table, or the Prophet model, if available (once per process, thread-safe)."""
+    global ml_model, ml_model_error, forecast_table
 
-    if ml_model is not None:
+    if forecast_table is not None or ml_model is not None:
         return True  # Already loaded
 
-    print(f"🔍 Attempting to load ML model...", file=sys.stderr)
-    print(f"   Path: {ML_MODEL_PATH}", file=sys.stderr)
-    print(f"   Exists: {ML_MODEL_PATH.exists()}", file=sys.stderr)
-    print(f"   Current dir: {Path.cwd()}", file=sys.stderr)
-
-    if ML_MODEL_PATH.exists():
-        try:
-            print("📥 Loading Prophet model...", file=sys.stderr)
-            with open(ML_MODEL_PATH, 'rb') as f:
-                ml_model = pickle.load(f)
-            print("✅ ML prediction model loaded successfully", file=sys.stderr)
+    # Only one thread deserializes; the others wait and reuse its result
+    with ml_model_lock:
+        if forecast_table is not None or ml_model is not None:
             return True
-        except Exception as e:
-            ml_model_error = str(e)
-            print(f"❌ Failed to load ML model: {e}", file=sys.stderr)
-            import traceback
-            traceback.print_exc(file=sys.stderr)
+
+        if FORECAST_TABLE_PATH.exists():
+            try:
+                # Memory-mapped: pages are shared between workers and read on demand
+                forecast_table = np.load(FORECAST_TABLE_PATH, mmap_mode='r')
+                print(f"✅ Forecast table loaded from {FORECAST_TABLE_PATH}", file=sys.stderr)
+                return True
+            except Exception as e:
+                print(f"⚠️  Failed to load forecast table, falling back to Prophet: {e}", file=sys.stderr)
+
+        print(f"🔍 Attempting to load ML model...", file=sys.stderr)
+        print(f"   Path: {ML_MODEL_PATH}", file=sys.stderr)
+        print(f"   Exists: {ML_MODEL_PATH.exists()}", file=sys.stderr)
+        print(f"   Current dir: {Path.cwd()}", file=sys.stderr)
+
+        if ML_MODEL_PATH.exists():
+            try:
+                print("📥 Loading Prophet model...", file=sys.stderr)
+                # Deferred import: prophet pulls in the Stan toolchain, which
+                # non-ML requests and worker boot should not pay for
+                import prophet  # noqa: F401 (needed to unpickle the model)
+                with open(ML_MODEL_PATH, 'rb') as f:
+                    ml_model = pickle.load(f)
+                print("✅ ML prediction model loaded successfully", file=sys.stderr)
+                return True
+            except Exception as e:
+                ml_model_error = str(e)
+                print(f"❌ Failed to load ML model: {e}", file=sys.stderr)
+                import traceback
+                traceback.print_exc(file=sys.stderr)
+                return False
+        else:
+            ml_model_error = f"Model file not found at {ML_MODEL_PATH}"
+            print(f"❌ {ml_model_error}", file=sys.stderr)
+            # List what files ARE there
+            models_dir = Path("/app/models")
+            if models_dir.exists():
+                print(f"   Files in models dir: {list(models_dir.glob('*'))}", file=sys.stderr)
             return False
-    else:
-        ml_model_error = f"Model file not found at {ML_MODEL_PATH}"
-        print(f"❌ {ml_model_error}", file=sys.stderr)
-        # List what files ARE there
-        models_dir = Path("/app/models")
-        if models_dir.exists():
-            print(f"   Files in models dir: {list(models_dir.glob('*'))}", file=sys.stderr)
-        return False
+
+def forecast_from_table(future_dates):
+    """Look up (yhat, yhat_lower, yhat_upper) rows for each date in the forecast table."""
+    # Rows are laid out as (day_of_year - 1) * 24 + hour
+    positions = (future_dates.dayofyear.to_numpy() - 1) * 24 + future_dates.hour.to_numpy()
+    return np.asarray(forecast_table[positions])
 
 def predict_next_24h():
-    """Predict grid intensity for next 24 hours."""
-    global ml_model
+    """Predict grid intensity for next 24 hours, reusing the current hour's forecast."""
+    key = datetime.now(IST).replace(minute=0, second=0, microsecond=0)
+    if forecast_cache['key'] == key:
+        return forecast_cache['value']
 
     # Lazy load model if not loaded
-    if ml_model is None:
-        load_ml_model()
-
-    if ml_model is None:
+    if not load_ml_model():
         return None
 
-    try:
-        now = datetime.now(IST).replace(tzinfo=None)
-        future_dates = pd.date_range(start=now, end=now + timedelta(hours=24), freq='H')
-        future = pd.DataFrame({'ds': future_dates})
-
-        forecast = ml_model.predict(future)
-
-        result = []
-        for _, row in forecast.iterrows():
-            result.append({
-                'timestamp': pd.to_datetime(row['ds']).tz_localize(IST).isoformat(),
-                'hour': pd.to_datetime(row['ds']).hour,
-                'predicted_intensity': round(float(row['yhat']), 2),
-                'lower_bound': round(float(row['yhat_lower']), 2),
-                'upper_bound': round(float(row['yhat_upper']), 2)
-            })
-
-        return result
-    except Exception as e:
-        print(f"Prediction error: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+    # One thread computes the forecast per hour; the rest wait and reuse its result
+    with forecast_cache_lock:
+        if forecast_cache['key'] == key:
+            return forecast_cache['value']
+
+        try:
+            now = datetime.now(IST).replace(tzinfo=None)
+            # Now plus the next 24 hours ('H' is deprecated in newer pandas)
+            future_dates = pd.date_range(start=now, periods=25, freq='h')
+
+            if forecast_table is not None:
+                # Table rows are already [yhat, yhat_lower, yhat_upper]; no DataFrame roundtrip
+                values = forecast_from_table(future_dates)
+            else:
+                forecast = ml_model.predict(pd.DataFrame({'ds': future_dates}))
+                values = forecast[['yhat', 'yhat_lower', 'yhat_upper']].to_numpy()
+
+            # Column-wise conversion: tolist() converts whole columns to Python
+            # ints/floats in C; to_pydatetime() yields plain datetimes that
+            # orjson encodes natively
+            timestamps = future_dates.tz_localize(IST).to_pydatetime()
+            hours = future_dates.hour.tolist()
+            result = [
+                {
+                    'timestamp': ts,
+                    'hour': hour,
+                    'predicted_intensity': predicted,
+                    'lower_bound': lower,
+                    'upper_bound': upper
+                }
+                for ts, hour, (predicted, lower, upper)
+                in zip(timestamps, hours, np.round(values, 2).tolist())
+            ]
+
+            forecast_cache['value'] = result
+            forecast_cache['key'] = key
+            return result
+        except Exception as e:
+            print(f"Prediction error: {e}")
+            import traceback
+            traceback.print_exc()
+            return None
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SET timezone = 'Asia/Kolkata'")
-        cur.execute("SHOW timezone")
-        db_timezone = cur.fetchone()[0]
-        cur.close()
-        conn.close()
-        db_status = "healthy"
-    except Exception as e:
-        db_status = f"error: {str(e)}"
-        db_timezone = "unknown"
+    # Probes arrive every few seconds from every replica; reuse a recent DB check
+    cached = get_cached_response('health', ttl=HEALTH_CACHE_TTL_SECONDS)
+    if cached is not None:
+        db_status, db_timezone = cached
+    else:
+        try:
+            with db_cursor() as cur:
+                cur.execute("SHOW timezone")
+                db_timezone = cur.fetchone()[0]
+            db_status = "healthy"
+        except Exception as e:
+            db_status = f"error: {str(e)}"
+            db_timezone = "unknown"
+        set_cached_response('health', (db_status, db_timezone))
 
     return jsonify({
         "status": "healthy" if db_status == "healthy" else "degraded",
         "database": db_status,
         "timezone": db_timezone,
-        "timestamp": datetime.now(IST).isoformat()
+        "timestamp": datetime.now(IST)
     }), 200
 
+def parse_metric(data):
+    """Flatten an ingest payload into a device_metrics row."""
+    system_metrics = data['system_metrics']
+    location = data.get('location', {})
+
+    return {
+        'device_id': data['device_id'],
+        'device_type': data.get('device_type', 'laptop'),
+        # Parsed by Postgres as TIMESTAMPTZ: offsets and 'Z' are honoured,
+        # naive values take the session timezone (IST)
+        'timestamp': data['timestamp'],
+        'latitude': location.get('latitude'),
+        'longitude': location.get('longitude'),
+        'city': location.get('city'),
+        'region': location.get('region'),
+        'country': location.get('country'),
+        'country_code': location.get('country_code'),
+        'cpu_percent': system_metrics.get('cpu_percent'),
+        'memory_percent': system_metrics.get('memory_percent'),
+        'total_power_watts': system_metrics.get('total_power_watts'),
+        'cpu_count': system_metrics.get('cpu_count'),
+        'applications': data.get('applications', [])
+    }
+
+# Column order shared by the JSON recordset, the COPY staging table and the insert
+DEVICE_METRIC_COLUMNS = (
+    'device_id', 'device_type', 'timestamp',
+    'latitude', 'longitude', 'city', 'region', 'country', 'country_code',
+    'cpu_percent', 'memory_percent', 'total_power_watts', 'cpu_count', 'applications'
+)
+
+DEVICE_METRIC_COLUMN_TYPES = """
+    device_id VARCHAR, device_type VARCHAR, timestamp TIMESTAMPTZ,
+    latitude FLOAT8, longitude FLOAT8,
+    city VARCHAR, region VARCHAR, country VARCHAR, country_code VARCHAR,
+    cpu_percent FLOAT8, memory_percent FLOAT8, total_power_watts FLOAT8,
+    cpu_count INTEGER, applications JSONB
+"""
+
+def device_metrics_insert_sql(source: str) -> str:
+    """
+    Build the statement inserting every row produced by `source` (a FROM-clause item).
+
+    The same statement fans each row's applications out into
+    device_application_samples, keeping both tables in one atomic write.
+    It returns the inserted record ids.
+    """
+    columns = ', '.join(DEVICE_METRIC_COLUMNS)
+    return f"""
+        WITH inserted AS (
+            INSERT INTO device_metrics ({columns})
+            SELECT {columns}
+            FROM {source}
+            RETURNING id, applications
+        ), samples AS (
+            INSERT INTO device_application_samples
+            (metric_id, app_name, pid, cpu_percent, memory_percent, power_watts)
+            SELECT
+                inserted.id, a.app_name, a.pid,
+                a.cpu_percent, a.memory_percent, a.estimated_power_watts
+            FROM inserted,
+                 jsonb_to_recordset(inserted.applications) AS a(
+                     app_name TEXT, pid INTEGER,
+                     cpu_percent FLOAT8, memory_percent FLOAT8, estimated_power_watts FLOAT8
+                 )
+        )
+        SELECT id FROM inserted
+    """
+
+INSERT_DEVICE_METRICS_JSON_SQL = device_metrics_insert_sql(
+    f"json_to_recordset($1::json) AS x({DEVICE_METRIC_COLUMN_TYPES})"
+)
+
+# Backslash first, so the escapes added after it are not doubled
+COPY_TEXT_ESCAPES = (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r'))
+
+def copy_text_field(column: str, value) -> str:
+    """
+    Encode one value for COPY's text format.
+
+    None becomes \\N, the SQL NULL the JSON path produces for missing or
+    null keys, so both paths store identical rows.
+    """
+    if value is None:
+        return '\\N'
+    if column == 'applications':
+        value = orjson.dumps(value, default=str).decode()
+    value = str(value)
+    for char, escaped in COPY_TEXT_ESCAPES:
+        value = value.replace(char, escaped)
+    return value
+
+def copy_insert_device_metrics(cur, rows):
+    """
+    Stage a large batch with COPY, then insert it with the shared statement.
+
+    COPY streams tab-separated text instead of making Postgres parse one very
+    large JSON document. The staging table is dropped at commit, so this runs
+    in its own transaction rather than on the pool's usual autocommit.
+    """
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(copy_text_field(column, row[column]) for column in DEVICE_METRIC_COLUMNS))
+        buf.write('\n')
+    buf.seek(0)
+
+    cur.connection.autocommit = False
+    cur.execute(f"CREATE TEMP TABLE device_metrics_staging ({DEVICE_METRIC_COLUMN_TYPES}) ON COMMIT DROP")
+    cur.copy_expert(
+        f"COPY device_metrics_staging ({', '.join(DEVICE_METRIC_COLUMNS)}) FROM STDIN WITH (FORMAT text)",
+        buf
+    )
+    # Not prepared: the plan would reference a temp table dropped at commit
+    cur.execute(device_metrics_insert_sql("device_metrics_staging"))
+    return [row[0] for row in cur.fetchall()]
+
+def bulk_insert_device_metrics(cur, rows):
+    """
+    Insert any number of metric rows with a single statement.
+
+    The rows travel as one JSON parameter and are expanded server-side by
+    json_to_recordset, so the statement text is identical for every batch
+    size and never approaches the 65535 bind-parameter limit. Batches of
+    COPY_BATCH_THRESHOLD rows or more are staged with COPY instead.
+
+    Returns:
+        List of inserted record ids
+    """
+    if len(rows) >= COPY_BATCH_THRESHOLD:
+        return copy_insert_device_metrics(cur, rows)
+
+    execute_prepared(
+        cur, 'insert_device_metrics', INSERT_DEVICE_METRICS_JSON_SQL,
+        (orjson.dumps(rows, default=str).decode(),)
+    )
+    return [row[0] for row in cur.fetchall()]
+
 @app.route('/api/v1/metrics/ingest', methods=['POST'])
 def ingest_metrics():
     try:
-        data = request.get_json()
-        device_id = data['device_id']
-        system_metrics = data['system_metrics']
-        applications = data.get('applications', [])
-        location = data.get('location', {})
-
-        # Parse timestamp - handle both with/without timezone
-        timestamp_str = data['timestamp']
-        if '+' in timestamp_str or 'Z' in timestamp_str:
-            # Already has timezone
-            timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-        else:
-            # Assume IST
-            timestamp = datetime.fromisoformat(timestamp_str).replace(tzinfo=IST)
+        row = parse_metric(request.get_json())
 
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SET timezone = 'Asia/Kolkata'")
-
-        cur.execute("""
-            INSERT INTO device_metrics
-            (device_id, device_type, timestamp,
-             latitude, longitude, city, region, country, country_code,
-             cpu_percent, memory_percent, total_power_watts, cpu_count, applications)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """, (
-            device_id,
-            data.get('device_type', 'laptop'),
-            timestamp,
-            location.get('latitude'),
-            location.get('longitude'),
-            location.get('city'),
-            location.get('region'),
-            location.get('country'),
-            location.get('country_code'),
-            system_metrics.get('cpu_percent'),
-            system_metrics.get('memory_percent'),
-            system_metrics.get('total_power_watts'),
-            system_metrics.get('cpu_count'),
-            json.dumps(applications)
-        ))
-        record_id = cur.fetchone()[0]
-        conn.commit()
-        cur.close()
-        conn.close()
+        with db_cursor() as cur:
+            record_id = bulk_insert_device_metrics(cur, [row])[0]
 
         return jsonify({"status": "accepted", "record_id": record_id}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/v1/stats', methods=['GET'])
-def get_stats():
+@app.route('/api/v1/metrics/ingest_batch', methods=['POST'])
+def ingest_metrics_batch():
+    """Ingest a JSON array of metric payloads in one statement."""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SET timezone = 'Asia/Kolkata'")
+        data = request.get_json()
+        if not isinstance(data, list):
+            return jsonify({"error": "Expected a JSON array of metrics"}), 400
+        if not data:
+            return jsonify({"status": "accepted", "record_ids": [], "count": 0}), 201
 
-        cur.execute("""
+        rows = [parse_metric(item) for item in data]
+
+        with db_cursor() as cur:
+            record_ids = bulk_insert_device_metrics(cur, rows)
+
+        return jsonify({"status": "accepted", "record_ids": record_ids, "count": len(record_ids)}), 201
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def build_stats():
+    """Device metrics totals (cached for RESPONSE_CACHE_TTL_SECONDS)."""
+    cached = get_cached_response('stats')
+    if cached is not None:
+        return cached
+
+    with db_cursor() as cur:
+        execute_prepared(cur, 'stats', """
             SELECT
                 COUNT(*) as total_records,
                 COUNT(DISTINCT device_id) as unique_devices,
-                COALESCE(AVG(total_power_watts), 0) as avg_power,
-                COUNT(DISTINCT city) as unique_cities
+                COUNT(DISTINCT city) as unique_cities,
+                ROUND(COALESCE(AVG(total_power_watts), 0)::numeric, 2)::float8 as average_power_watts
             FROM device_metrics
         """)
-        stats = cur.fetchone()
-        cur.close()
-        conn.close()
+        columns = [column.name for column in cur.description]
+        payload = dict(zip(columns, cur.fetchone()))
+
+    payload["timezone"] = "Asia/Kolkata (IST)"
+    set_cached_response('stats', payload)
+    return payload
+
+def build_carbon_summary():
+    """Overall carbon totals (cached for RESPONSE_CACHE_TTL_SECONDS)."""
+    cached = get_cached_response('carbon_summary')
+    if cached is not None:
+        return cached
+
+    with db_cursor() as cur:
+        # Maintained by the profiling worker (REFRESH ... CONCURRENTLY);
+        # rounded and typed here so the row goes straight to the encoder
+        execute_prepared(cur, 'carbon_summary', """
+            SELECT
+                total_measurements,
+                ROUND(COALESCE(total_operational_g, 0)::numeric, 4)::float8 as operational_carbon_grams,
+                ROUND(COALESCE(total_embodied_g, 0)::numeric, 4)::float8 as embodied_carbon_grams,
+                ROUND(COALESCE(total_carbon_g, 0)::numeric, 4)::float8 as total_carbon_grams,
+                ROUND((COALESCE(total_carbon_g, 0) / 1000)::numeric, 6)::float8 as total_carbon_kg,
+                ROUND(COALESCE(total_operational_g / NULLIF(total_carbon_g, 0) * 100, 0)::numeric, 2)::float8
+                    as operational_percentage,
+                ROUND(COALESCE(total_embodied_g / NULLIF(total_carbon_g, 0) * 100, 0)::numeric, 2)::float8
+                    as embodied_percentage,
+                ROUND(COALESCE(avg_carbon_per_measurement, 0)::numeric, 6)::float8 as avg_carbon_per_measurement_g,
+                ROUND(COALESCE(total_energy_kwh, 0)::numeric, 6)::float8 as total_energy_kwh,
+                unique_devices
+            FROM mv_carbon_summary
+        """)
+        columns = [column.name for column in cur.description]
+        payload = dict(zip(columns, cur.fetchone()))
+
+    payload["timezone"] = "Asia/Kolkata (IST)"
+    set_cached_response('carbon_summary', payload)
+    return payload
+
+# Maintained by the profiling worker (REFRESH ... CONCURRENTLY)
+CARBON_BY_DEVICE_SQL = f"""
+    SELECT
+        device_id,
+        device_type,
+        measurement_count,
+        ROUND(total_operational_g::numeric, 4)::float8 as operational_carbon_grams,
+        ROUND(total_embodied_g::numeric, 4)::float8 as embodied_carbon_grams,
+        ROUND(total_carbon_g::numeric, 4)::float8 as total_carbon_grams,
+        ROUND((total_carbon_g / 1000)::numeric, 6)::float8 as total_carbon_kg,
+        ROUND(COALESCE(avg_embodied_total_kg, 0)::numeric, 2)::float8 as embodied_total_device_kg,
+        to_char(first_seen, '{ISO_TIMESTAMP_FORMAT}') as first_seen,
+        to_char(last_seen, '{ISO_TIMESTAMP_FORMAT}') as last_seen
+    FROM mv_carbon_by_device
+    ORDER BY total_carbon_g DESC
+"""
+
+def build_carbon_by_device():
+    """Per-device carbon totals, highest emitters first."""
+    with db_cursor() as cur:
+        execute_prepared(cur, 'carbon_by_device', CARBON_BY_DEVICE_SQL)
+
+        # Plain tuple rows unpacked by position (no per-row RealDictRow or zip)
+        devices = [
+            {
+                "device_id": device_id,
+                "device_type": device_type,
+                "measurement_count": measurement_count,
+                "operational_carbon_grams": operational_g,
+                "embodied_carbon_grams": embodied_g,
+                "total_carbon_grams": total_g,
+                "total_carbon_kg": total_kg,
+                "embodied_total_device_kg": embodied_total_kg,
+                "first_seen": first_seen,
+                "last_seen": last_seen
+            }
+            for (device_id, device_type, measurement_count, operational_g, embodied_g,
+                 total_g, total_kg, embodied_total_kg, first_seen, last_seen) in cur
+        ]
+
+    return {
+        "devices": devices,
+        "total_devices": len(devices),
+        "timezone": "Asia/Kolkata (IST)"
+    }
+
+def build_carbon_by_hour():
+    """Hourly carbon breakdown in IST."""
+    with db_cursor() as cur:
+        # Maintained by the profiling worker (REFRESH ... CONCURRENTLY)
+        execute_prepared(cur, 'carbon_by_hour', """
+            SELECT
+                hour::int as hour,
+                measurement_count,
+                ROUND(avg_grid_intensity::numeric, 2)::float8 as avg_grid_intensity_gco2_kwh,
+                ROUND(total_operational_g::numeric, 4)::float8 as operational_carbon_grams,
+                ROUND(total_embodied_g::numeric, 4)::float8 as embodied_carbon_grams,
+                ROUND(total_carbon_g::numeric, 4)::float8 as total_carbon_grams
+            FROM mv_carbon_by_hour
+            ORDER BY hour
+        """)
 
-        return jsonify({
-            "total_records": stats['total_records'],
-            "unique_devices": stats['unique_devices'],
-            "unique_cities": stats['unique_cities'],
-            "average_power_watts": round(float(stats['avg_power']), 2),
-            "timezone": "Asia/Kolkata (IST)"
-        }), 200
+        result = [
+            {
+                "hour": hour,
+                "measurement_count": measurement_count,
+                "avg_grid_intensity_gco2_kwh": avg_intensity,
+                "operational_carbon_grams": operational_g,
+                "embodied_carbon_grams": embodied_g,
+                "total_carbon_grams": total_g
+            }
+            for hour, measurement_count, avg_intensity, operational_g, embodied_g, total_g in cur
+        ]
+
+    return {
+        "hourly_breakdown": result,
+        "timezone": "Asia/Kolkata (IST)"
+    }
+
+@app.route('/api/v1/stats', methods=['GET'])
+def get_stats():
+    try:
+        return jsonify(build_stats()), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -271,142 +884,47 @@ def get_stats():
 def carbon_summary():
     """Get overall carbon footprint summary with embodied carbon breakdown."""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SET timezone = 'Asia/Kolkata'")
-
-        cur.execute("""
-            SELECT
-                COUNT(*) as total_measurements,
-                SUM(operational_carbon_gco2) as total_operational_g,
-                SUM(embodied_carbon_gco2) as total_embodied_g,
-                SUM(total_carbon_gco2) as total_carbon_g,
-                AVG(total_carbon_gco2) as avg_carbon_per_measurement,
-                SUM(power_kwh) as total_energy_kwh,
-                COUNT(DISTINCT device_id) as unique_devices
-            FROM carbon_footprints
-        """)
-
-        summary = cur.fetchone()
-        cur.close()
-        conn.close()
-
-        total_operational = float(summary['total_operational_g'] or 0)
-        total_embodied = float(summary['total_embodied_g'] or 0)
-        total_carbon = float(summary['total_carbon_g'] or 0)
-
-        operational_pct = (total_operational / total_carbon * 100) if total_carbon > 0 else 0
-        embodied_pct = (total_embodied / total_carbon * 100) if total_carbon > 0 else 0
-
-        return jsonify({
-            "total_measurements": summary['total_measurements'],
-            "operational_carbon_grams": round(total_operational, 4),
-            "embodied_carbon_grams": round(total_embodied, 4),
-            "total_carbon_grams": round(total_carbon, 4),
-            "total_carbon_kg": round(total_carbon / 1000, 6),
-            "operational_percentage": round(operational_pct, 2),
-            "embodied_percentage": round(embodied_pct, 2),
-            "avg_carbon_per_measurement_g": round(float(summary['avg_carbon_per_measurement'] or 0), 6),
-            "total_energy_kwh": round(float(summary['total_energy_kwh'] or 0), 6),
-            "unique_devices": summary['unique_devices'],
-            "timezone": "Asia/Kolkata (IST)"
-        }), 200
+        return jsonify(build_carbon_summary()), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/v1/carbon/by-device', methods=['GET'])
 def carbon_by_device():
-    """Get carbon footprint breakdown by device with embodied carbon."""
+    """Get carbon footprint breakdown by device with embodied carbon (streamed)."""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SET timezone = 'Asia/Kolkata'")
-
-        cur.execute("""
-            SELECT
-                device_id,
-                device_type,
-                COUNT(*) as measurement_count,
-                SUM(operational_carbon_gco2) as total_operational_g,
-                SUM(embodied_carbon_gco2) as total_embodied_g,
-                SUM(total_carbon_gco2) as total_carbon_g,
-                AVG(embodied_total_kgco2e) as avg_embodied_total_kg,
-                MIN(timestamp) as first_seen,
-                MAX(timestamp) as last_seen
-            FROM carbon_footprints
-            GROUP BY device_id, device_type
-            ORDER BY total_carbon_g DESC
-        """)
-
-        devices = cur.fetchall()
-        cur.close()
-        conn.close()
-
-        result = []
-        for device in devices:
-            total_carbon = float(device['total_carbon_g'])
-            total_operational = float(device['total_operational_g'])
-            total_embodied = float(device['total_embodied_g'])
-
-            result.append({
-                "device_id": device['device_id'],
-                "device_type": device['device_type'],
-                "measurement_count": device['measurement_count'],
-                "operational_carbon_grams": round(total_operational, 4),
-                "embodied_carbon_grams": round(total_embodied, 4),
-                "total_carbon_grams": round(total_carbon, 4),
-                "total_carbon_kg": round(total_carbon / 1000, 6),
-                "embodied_total_device_kg": round(float(device['avg_embodied_total_kg'] or 0), 2),
-                "first_seen": device['first_seen'].isoformat(),
-                "last_seen": device['last_seen'].isoformat()
-            })
-
-        return jsonify({
-            "devices": result,
-            "total_devices": len(result),
-            "timezone": "Asia/Kolkata (IST)"
-        }), 200
+        conn, cur, first = open_stream_cursor('carbon_by_device', CARBON_BY_DEVICE_SQL)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    return stream_rows_response(
+        conn, cur, first,
+        b'{"timezone":"Asia/Kolkata (IST)","devices":[',
+        'total_devices'
+    ), 200
+
 @app.route('/api/v1/carbon/by-hour', methods=['GET'])
 def carbon_by_hour():
     """Get carbon footprint by hour with embodied carbon breakdown (IST timezone)."""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SET timezone = 'Asia/Kolkata'")
-
-        cur.execute("""
-            SELECT
-                EXTRACT(HOUR FROM timestamp AT TIME ZONE 'Asia/Kolkata') as hour,
-                COUNT(*) as measurement_count,
-                AVG(grid_intensity_gco2_per_kwh) as avg_grid_intensity,
-                SUM(operational_carbon_gco2) as total_operational_g,
-                SUM(embodied_carbon_gco2) as total_embodied_g,
-                SUM(total_carbon_gco2) as total_carbon_g
-            FROM carbon_footprints
-            GROUP BY EXTRACT(HOUR FROM timestamp AT TIME ZONE 'Asia/Kolkata')
-            ORDER BY hour
-        """)
+        return jsonify(build_carbon_by_hour()), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        hours = cur.fetchall()
-        cur.close()
-        conn.close()
-
-        result = []
-        for hour_data in hours:
-            result.append({
-                "hour": int(hour_data['hour']),
-                "measurement_count": hour_data['measurement_count'],
-                "avg_grid_intensity_gco2_kwh": round(float(hour_data['avg_grid_intensity']), 2),
-                "operational_carbon_grams": round(float(hour_data['total_operational_g']), 4),
-                "embodied_carbon_grams": round(float(hour_data['total_embodied_g']), 4),
-                "total_carbon_grams": round(float(hour_data['total_carbon_g']), 4)
-            })
+@app.route('/api/v1/dashboard', methods=['GET'])
+def dashboard():
+    """Get system stats plus summary, per-device and hourly carbon data in one response."""
+    try:
+        # Independent queries run concurrently, each on its own connection
+        stats = query_executor.submit(build_stats)
+        summary = query_executor.submit(build_carbon_summary)
+        by_device = query_executor.submit(build_carbon_by_device)
+        by_hour = query_executor.submit(build_carbon_by_hour)
 
         return jsonify({
-            "hourly_breakdown": result,
+            "system_stats": stats.result(),
+            "carbon_summary": summary.result(),
+            "by_device": by_device.result(),
+            "by_hour": by_hour.result(),
             "timezone": "Asia/Kolkata (IST)"
         }), 200
     except Exception as e:
@@ -414,88 +932,62 @@ def carbon_by_hour():
 
 @app.route('/api/v1/carbon/device/<device_id>', methods=['GET'])
 def carbon_device_detail(device_id: str):
-    """Get detailed carbon footprint for a specific device."""
+    """Get detailed carbon footprint for a specific device (streamed)."""
     try:
-        limit = request.args.get('limit', type=int, default=50)
-
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SET timezone = 'Asia/Kolkata'")
+        limit = max(1, min(request.args.get('limit', type=int, default=50), MAX_DETAIL_LIMIT))
 
-        cur.execute("""
+        conn, cur, first = open_stream_cursor('carbon_device_detail', f"""
             SELECT
-                timestamp,
+                to_char(timestamp, '{ISO_TIMESTAMP_FORMAT}') as timestamp,
                 power_kwh,
-                grid_intensity_gco2_per_kwh,
+                grid_intensity_gco2_per_kwh as grid_intensity_gco2_kwh,
                 operational_carbon_gco2,
                 embodied_carbon_gco2,
                 total_carbon_gco2,
-                calculated_at
+                to_char(calculated_at, '{ISO_TIMESTAMP_FORMAT}') as calculated_at
             FROM carbon_footprints
             WHERE device_id = %s
             ORDER BY timestamp DESC
             LIMIT %s
         """, (device_id, limit))
-
-        records = cur.fetchall()
-        cur.close()
-        conn.close()
-
-        if not records:
-            return jsonify({"error": f"No carbon data for device {device_id}"}), 404
-
-        result = []
-        for record in records:
-            result.append({
-                "timestamp": record['timestamp'].isoformat(),
-                "power_kwh": float(record['power_kwh']),
-                "grid_intensity_gco2_kwh": float(record['grid_intensity_gco2_per_kwh']),
-                "operational_carbon_gco2": float(record['operational_carbon_gco2']),
-                "embodied_carbon_gco2": float(record['embodied_carbon_gco2']),
-                "total_carbon_gco2": float(record['total_carbon_gco2']),
-                "calculated_at": record['calculated_at'].isoformat()
-            })
-
-        return jsonify({
-            "device_id": device_id,
-            "record_count": len(result),
-            "measurements": result,
-            "timezone": "Asia/Kolkata (IST)"
-        }), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    if first is None:
+        close_stream_cursor(conn, cur)
+        return jsonify({"error": f"No carbon data for device {device_id}"}), 404
+
+    return stream_rows_response(
+        conn, cur, first,
+        b'{"device_id":' + orjson.dumps(device_id) + b',"timezone":"Asia/Kolkata (IST)","measurements":[',
+        'record_count'
+    ), 200
+
 @app.route('/api/v1/metrics/devices', methods=['GET'])
 def list_devices():
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SET timezone = 'Asia/Kolkata'")
-
-        cur.execute("""
-            SELECT
-                device_id,
-                city,
-                country,
-                COUNT(*) as record_count,
-                MAX(timestamp) as last_seen
-            FROM device_metrics
-            GROUP BY device_id, city, country
-        """)
-        devices = cur.fetchall()
-        cur.close()
-        conn.close()
-
-        # Convert timestamps to IST
-        for device in devices:
-            if device['last_seen']:
-                device['last_seen'] = device['last_seen'].isoformat()
+        with db_cursor() as cur:
+            # Postgres renders the whole response body; it is returned verbatim
+            execute_prepared(cur, 'list_devices', f"""
+                SELECT json_build_object(
+                    'devices', COALESCE(json_agg(d), '[]'::json),
+                    'total', COUNT(*),
+                    'timezone', 'Asia/Kolkata (IST)'
+                )::text
+                FROM (
+                    SELECT
+                        device_id,
+                        city,
+                        country,
+                        COUNT(*) as record_count,
+                        to_char(MAX(timestamp), '{ISO_TIMESTAMP_FORMAT}') as last_seen
+                    FROM device_metrics
+                    GROUP BY device_id, city, country
+                ) d
+            """)
+            body = cur.fetchone()[0]
 
-        return jsonify({
-            "devices": devices,
-            "total": len(devices),
-            "timezone": "Asia/Kolkata (IST)"
-        }), 200
+        return app.response_class(body, mimetype='application/json'), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -504,9 +996,7 @@ def list_devices():
 def ml_predict_24h():
     """Get ML predictions for next 24 hours."""
     # Try to load model
-    load_ml_model()
-
-    if ml_model is None:
+    if not load_ml_model():
         error_msg = ml_model_error or 'Model not available'
         print(f"❌ ML endpoint called but model unavailable: {error_msg}", file=sys.stderr)
         return jsonify({
@@ -522,28 +1012,26 @@ def ml_predict_24h():
         'predictions': predictions,
         'model_available': True,
         'timezone': 'Asia/Kolkata (IST)',
-        'generated_at': datetime.now(IST).isoformat()
+        'generated_at': datetime.now(IST)
     }), 200
 
 @app.route('/api/v1/ml/greenest-hours', methods=['GET'])
 def ml_greenest_hours():
     """Get greenest hours from ML predictions."""
-    load_ml_model()
-    if ml_model is None:
+    if not load_ml_model():
         return jsonify({'error': 'ML model not available'}), 503
 
     predictions = predict_next_24h()
     if predictions is None:
         return jsonify({'error': 'Prediction failed'}), 500
 
-    # Sort by intensity and get top 5
-    sorted_predictions = sorted(predictions, key=lambda x: x['predicted_intensity'])
-    greenest = sorted_predictions[:5]
+    # Five lowest-intensity hours, without sorting the whole list
+    greenest = nsmallest(5, predictions, key=itemgetter('predicted_intensity'))
 
     return jsonify({
         'greenest_hours': greenest,
         'timezone': 'Asia/Kolkata (IST)',
-        'generated_at': datetime.now(IST).isoformat()
+        'generated_at': datetime.now(IST)
     }), 200
 
 @app.route('/api/v1/ml/recommendation', methods=['GET'])
@@ -555,18 +1043,26 @@ def ml_recommendation():
         return jsonify({'error': 'Prediction failed'}), 500
 
     current_hour = datetime.now(IST).hour
-    current_pred = next((p for p in predictions if p['hour'] == current_hour), predictions[0])
 
-    avg_intensity = sum(p['predicted_intensity'] for p in predictions) / len(predictions)
-    min_intensity = min(p['predicted_intensity'] for p in predictions)
+    # One pass into contiguous arrays instead of a Python scan per statistic
+    count = len(predictions)
+    intensities = np.fromiter((p['predicted_intensity'] for p in predictions), dtype=np.float64, count=count)
+    hours = np.fromiter((p['hour'] for p in predictions), dtype=np.int8, count=count)
 
-    current_intensity = current_pred['predicted_intensity']
+    avg_intensity = float(intensities.mean())
+    greenest_idx = int(intensities.argmin())
+    min_intensity = float(intensities[greenest_idx])
+
+    # Forecast hours wrap past midnight, so look the current hour up rather than bisecting
+    current_matches = np.flatnonzero(hours == current_hour)
+    current_idx = int(current_matches[0]) if current_matches.size else 0
+    current_intensity = float(intensities[current_idx])
     percent_vs_avg = ((current_intensity - avg_intensity) / avg_intensity) * 100
     percent_vs_best = ((current_intensity - min_intensity) / min_intensity) * 100
 
     # Find greenest hour
-    greenest = min(predictions, key=lambda x: x['predicted_intensity'])
-    hours_until_greenest = (greenest['hour'] - current_hour) % 24
+    greenest_hour = int(hours[greenest_idx])
+    hours_until_greenest = (greenest_hour - current_hour) % 24
 
     # Generate recommendation
     if percent_vs_avg < -15:
@@ -596,10 +1092,10 @@ def ml_recommendation():
         'percent_vs_best': round(percent_vs_best, 2),
         'message': message,
         'action': action,
-        'greenest_hour': greenest['hour'],
+        'greenest_hour': greenest_hour,
         'hours_until_greenest': hours_until_greenest,
         'timezone': 'Asia/Kolkata (IST)',
-        'generated_at': datetime.now(IST).isoformat()
+        'generated_at': datetime.now(IST)
     }), 200
 
 @app.route('/api/v1/insights/missed-opportunities', methods=['GET'])
@@ -607,76 +1103,71 @@ def missed_opportunities():
     """Calculate missed carbon savings opportunities."""
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute("SET timezone = 'Asia/Kolkata'")
-
-        # Get last 24 hours of actual usage
-        cur.execute("""
-            SELECT
-                EXTRACT(HOUR FROM timestamp) as hour,
-                SUM(total_carbon_gco2) as actual_carbon,
-                AVG(grid_intensity_gco2_per_kwh) as actual_intensity,
-                SUM(power_kwh) as total_energy
-            FROM carbon_footprints
-            WHERE timestamp > NOW() - INTERVAL '24 hours'
-            GROUP BY EXTRACT(HOUR FROM timestamp)
-            ORDER BY hour
-        """)
-
-        actual_usage = cur.fetchall()
-        cur.close()
-        conn.close()
-
-        if not actual_usage:
-            return jsonify({'message': 'Not enough data yet'}), 200
-
-        # Get today's predictions for comparison
+        # Compare against the greenest predicted hour
         predictions = predict_next_24h()
         if not predictions:
             return jsonify({'error': 'Could not generate predictions'}), 500
 
-        # Calculate missed opportunities
-        opportunities = []
-        total_missed_savings = 0
-
-        for usage in actual_usage:
-            hour = int(usage['hour'])
-            actual_carbon = float(usage['actual_carbon'])
-            actual_intensity = float(usage['actual_intensity'])
-            energy = float(usage['total_energy'])
-
-            # Find greenest hour in predictions
-            greenest = min(predictions, key=lambda x: x['predicted_intensity'])
-            optimal_intensity = greenest['predicted_intensity']
-            optimal_carbon = energy * optimal_intensity
-
-            if actual_intensity > optimal_intensity * 1.15:  # 15% threshold
-                savings = actual_carbon - optimal_carbon
-                total_missed_savings += savings
-
-                opportunities.append({
-                    'hour': hour,
-                    'actual_intensity': round(actual_intensity, 2),
-                    'optimal_intensity': round(optimal_intensity, 2),
-                    'optimal_hour': greenest['hour'],
-                    'carbon_emitted': round(actual_carbon, 4),
-                    'carbon_could_have_been': round(optimal_carbon, 4),
-                    'missed_savings_gco2': round(savings, 4),
-                    'percent_savings_missed': round((savings / actual_carbon) * 100, 1)
-                })
+        greenest = min(predictions, key=itemgetter('predicted_intensity'))
+
+        with db_cursor() as cur:
+            # Last 24 hours of actual usage, scored against the optimal intensity
+            # ($1) and rendered as the response body in a single aggregate row
+            execute_prepared(cur, 'missed_opportunities', """
+                WITH usage AS (
+                    SELECT
+                        EXTRACT(HOUR FROM timestamp)::int as hour,
+                        SUM(total_carbon_gco2) as actual_carbon,
+                        AVG(grid_intensity_gco2_per_kwh) as actual_intensity,
+                        SUM(power_kwh) as total_energy
+                    FROM carbon_footprints
+                    WHERE timestamp > NOW() - INTERVAL '24 hours'
+                    GROUP BY 1
+                ), scored AS (
+                    SELECT
+                        usage.*,
+                        total_energy * $1::float8 as optimal_carbon,
+                        actual_carbon - total_energy * $1::float8 as savings,
+                        actual_intensity > $1::float8 * 1.15 as missed  -- 15% threshold
+                    FROM usage
+                )
+                SELECT
+                    COUNT(*) as usage_hours,
+                    json_build_object(
+                        'opportunities', COALESCE(json_agg(json_build_object(
+                            'hour', hour,
+                            'actual_intensity', ROUND(actual_intensity::numeric, 2),
+                            'optimal_intensity', ROUND($1::numeric, 2),
+                            'optimal_hour', $2::int,
+                            'carbon_emitted', ROUND(actual_carbon::numeric, 4),
+                            'carbon_could_have_been', ROUND(optimal_carbon::numeric, 4),
+                            'missed_savings_gco2', ROUND(savings::numeric, 4),
+                            'percent_savings_missed', ROUND((savings / NULLIF(actual_carbon, 0) * 100)::numeric, 1)
+                        ) ORDER BY hour) FILTER (WHERE missed), '[]'::json),
+                        'total_missed_savings_gco2', ROUND(COALESCE(SUM(savings) FILTER (WHERE missed), 0)::numeric, 4),
+                        'total_missed_savings_kg', ROUND((COALESCE(SUM(savings) FILTER (WHERE missed), 0) / 1000)::numeric, 6),
+                        'opportunity_count', COUNT(*) FILTER (WHERE missed),
+                        'timezone', 'Asia/Kolkata (IST)'
+                    )::text
+                FROM scored
+            """, (greenest['predicted_intensity'], greenest['hour']))
+
+            usage_hours, body = cur.fetchone()
+
+        if not usage_hours:
+            return jsonify({'message': 'Not enough data yet'}), 200
 
-        return jsonify({
-            'opportunities': opportunities,
-            'total_missed_savings_gco2': round(total_missed_savings, 4),
-            'total_missed_savings_kg': round(total_missed_savings / 1000, 6),
-            'opportunity_count': len(opportunities),
-            'timezone': 'Asia/Kolkata (IST)'
-        }), 200
+        return app.response_class(body, mimetype='application/json'), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-if __name__ == '__main__':
-    load_ml_model()
-    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
+if os.environ.get('RUN_MIGRATIONS') != '1':
+    if os.environ.get('ML_MODEL_PRELOAD') == '1':
+        # gunicorn preload_app (see gunicorn_conf.py): load once in the master
+        # so every forked worker starts with the model already in memory
+        load_ml_model()
+    else:
+        # Warm the model off the request path so startup is not blocked; ML
+        # endpoints still lazy-load (behind ml_model_lock) if this has not finished
+        threading.Thread(target=load_ml_model, daemon=True).start()
@@ -5,6 +5,7 @@ Place in profiling-engine/ directory and run once
 """
 
 import pandas as pd
+import numpy as np
 import os
 os.environ["CMDSTAN"] = "/home/varunadhityagb/.cmdstan/cmdstan-2.37.0"
 
@@ -14,9 +15,19 @@ from pathlib import Path
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 import glob
+import hashlib
+
+try:
+    import pyarrow  # noqa: F401 (enables the parquet cache and the multithreaded CSV reader)
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
 
 IST = ZoneInfo("Asia/Kolkata")
 
+# Parsed-dataset cache, kept out of the source tree (ignored by git)
+CACHE_DIR = Path(".cache")
+
 def load_multiple_csv_files(pattern: str = "IN-SO_*_hourly.csv"):
     """Load and combine multiple years of data."""
     print(f"\n📂 Looking for files matching: {pattern}")
@@ -30,6 +41,16 @@ def load_multiple_csv_files(pattern: str = "IN-SO_*_hourly.csv"):
 
     print(f"   Found {len(csv_files)} file(s): {csv_files}")
 
+    # Parsed, IST-converted data is cached as parquet per set of input files;
+    # it is rebuilt whenever one of those CSVs is newer than the cache
+    existing_files = [csv_path for csv_path in csv_files if Path(csv_path).exists()]
+    cache_key = hashlib.md5('|'.join(existing_files).encode()).hexdigest()[:12]
+    cache_path = CACHE_DIR / f"combined_{cache_key}.parquet"
+    if (HAS_PYARROW and existing_files and cache_path.exists()
+            and cache_path.stat().st_mtime >= max(Path(f).stat().st_mtime for f in existing_files)):
+        print(f"   Using cached {cache_path}")
+        return pd.read_parquet(cache_path, engine='pyarrow')
+
     all_dfs = []
 
     for csv_path in csv_files:
@@ -38,7 +59,8 @@ def load_multiple_csv_files(pattern: str = "IN-SO_*_hourly.csv"):
             continue
 
         print(f"   Loading {csv_path}...")
-        df = pd.read_csv(csv_path)
+        # The pyarrow engine parses in parallel at the C++ layer
+        df = pd.read_csv(csv_path, engine='pyarrow' if HAS_PYARROW else 'c')
 
         # Parse datetime
         df['ds'] = pd.to_datetime(df['Datetime (UTC)'])
@@ -56,8 +78,39 @@ def load_multiple_csv_files(pattern: str = "IN-SO_*_hourly.csv"):
     combined_df = pd.concat(all_dfs, ignore_index=True)
     combined_df = combined_df.sort_values('ds').drop_duplicates(subset=['ds'])
 
+    if HAS_PYARROW:
+        CACHE_DIR.mkdir(exist_ok=True)
+        combined_df.to_parquet(cache_path, engine='pyarrow', compression='zstd', index=False)
+        print(f"   Cached combined dataset to {cache_path}")
+
     return combined_df
 
+def export_forecast_table(model, output_path: str = "models/grid_forecast_table.npy"):
+    """
+    Precompute hourly forecasts for the next 366 days as a lookup table.
+
+    Row (day_of_year - 1) * 24 + hour holds [yhat, yhat_lower, yhat_upper],
+    so the API can serve any hour with an array lookup instead of running
+    Prophet. Slots the window does not reach (Feb 29 / Dec 31 in a non-leap
+    span) are filled from the previous day.
+    """
+    start = datetime.now(IST).replace(minute=0, second=0, microsecond=0, tzinfo=None)
+    future = pd.DataFrame({'ds': pd.date_range(start=start, periods=24 * 366, freq='h')})
+    forecast = model.predict(future)
+
+    positions = (forecast['ds'].dt.dayofyear.to_numpy() - 1) * 24 + forecast['ds'].dt.hour.to_numpy()
+    table = np.full((24 * 366, 3), np.nan)
+    table[positions] = forecast[['yhat', 'yhat_lower', 'yhat_upper']].to_numpy()
+
+    for position in np.flatnonzero(np.isnan(table[:, 0])):
+        table[position] = table[position - 24]
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    np.save(output_path, table)
+
+    print(f"✅ Forecast table saved to {output_path} ({table.shape[0]} hourly rows from {start})")
+
 def train_model(csv_pattern: str = "IN-SO_*_hourly.csv", output_path: str = "models/grid_prophet.pkl"):
     """Train Prophet model on India grid data."""
 
@@ -102,6 +155,8 @@ def train_model(csv_pattern: str = "IN-SO_*_hourly.csv", output_path: str = "mod
 
     print(f"\n✅ Model trained and saved to {output_path}")
     print(f"   Training timestamp: {datetime.now(IST).strftime('%Y-%m-%d %H:%M:%S IST')}")
+
+    export_forecast_table(model, output_path.parent / "grid_forecast_table.npy")
     print("=" * 60)
 
     return True
@@ -115,7 +170,7 @@ if __name__ == "__main__":
 
     if success:
         print("\n✅ Next steps:")
-        print("   1. Copy model to profiling-engine: cp models/grid_prophet.pkl profiling-engine/models/")
+        print("   1. Copy model and forecast table to profiling-engine: cp models/grid_prophet.pkl models/grid_forecast_table.npy profiling-engine/models/")
         print("   2. Rebuild ingestion-api container: ./rebuild-minikube-keep-db")
         print("   3. Model will be automatically loaded on startup")
         print("   4. Access predictions at /api/v1/ml/predict-24h")
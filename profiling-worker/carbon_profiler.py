@@ -1,11 +1,15 @@
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import json
+import select
+import threading
 import time
 import os
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from typing import Optional
+from requests.adapters import HTTPAdapter
 
 # Indian Standard Time
 IST = ZoneInfo("Asia/Kolkata")
@@ -15,13 +19,24 @@ DB_CONFIG = {
     'port': os.environ.get('DB_PORT', '5432'),
     'database': os.environ.get('DB_NAME', 'carbon_metrics'),
     'user': os.environ.get('DB_USER', 'carbon_user'),
-    'password': os.environ.get('DB_PASSWORD', 'carbon_pass_123')
+    'password': os.environ.get('DB_PASSWORD', 'carbon_pass_123'),
+    # Sent in the startup packet, so the session is IST without a SET roundtrip.
+    # Footprints are derived data the worker can recompute, so its commits
+    # don't wait for the WAL flush.
+    'options': '-c timezone=Asia/Kolkata -c synchronous_commit=off'
 }
 
 # Electricity Maps Configuration
 ELECTRICITY_MAPS_TOKEN = os.environ.get('ELECTRICITY_MAPS_TOKEN', '')
 ELECTRICITY_MAPS_API = "https://api.electricitymaps.com/v3/carbon-intensity/latest"
 
+# Concurrent Electricity Maps lookups per cycle
+FETCH_WORKERS = 8
+
+# One keep-alive session, so lookups reuse TCP/TLS connections across cycles
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=16))
+
 # Fallback values by region (gCO2eq/kWh)
 FALLBACK_GRID_INTENSITY = {
     'IN': 632,    # India average
@@ -31,10 +46,22 @@ FALLBACK_GRID_INTENSITY = {
     'default': 475  # Global average
 }
 
-# Grid intensity cache (location-based)
-grid_intensity_cache = {}
+# Lifetime of a grid_intensity_cache entry (shared by all worker replicas)
 CACHE_TTL_SECONDS = 300  # 5 minutes
 
+# Minimum interval between refreshes of the API's aggregate views
+MV_REFRESH_INTERVAL_SECONDS = 60
+
+# Metrics profiled per cycle; a full batch means more are likely waiting.
+# The footprint arithmetic runs set-based in Postgres, so larger batches
+# only cost a bigger INSERT ... SELECT.
+BATCH_SIZE = int(os.environ.get('WORKER_BATCH_SIZE', '1000'))
+
+# The API's ingest trigger NOTIFYs this channel; the timeout is only a safety
+# net for missed notifications (e.g. across a reconnect)
+NOTIFY_CHANNEL = 'new_metric'
+NOTIFY_TIMEOUT_SECONDS = 30
+
 # Embodied carbon values
 EMBODIED_CARBON_KG = {
     "smartphone": 50,
@@ -54,16 +81,151 @@ EXPECTED_LIFETIME_YEARS = {
     "server": 5.0
 }
 
+# Seconds of power draw each device_metrics sample represents
+MEASUREMENT_INTERVAL_SECONDS = 5
+
+# Embodied carbon amortized over every measurement in the device lifetime,
+# resolved once per device type instead of per row
+EMBODIED_G_PER_MEASUREMENT = {
+    device_type: (EMBODIED_CARBON_KG[device_type] * 1000.0)
+    / (EXPECTED_LIFETIME_YEARS[device_type] * 365 * 24 * 3600 / MEASUREMENT_INTERVAL_SECONDS)
+    for device_type in EMBODIED_CARBON_KG
+}
+
+# The constant tables above as inline SQL rows: device types seed the
+# device_types table, fallbacks feed the server-side computation
+DEVICE_TYPES_SQL = ', '.join(
+    f"('{device_type}', {EMBODIED_CARBON_KG[device_type]}, "
+    f"{EXPECTED_LIFETIME_YEARS[device_type]}, {EMBODIED_G_PER_MEASUREMENT[device_type]!r})"
+    for device_type in EMBODIED_CARBON_KG
+)
+FALLBACK_INTENSITY_SQL = ', '.join(
+    f"('{country_code}', {intensity})"
+    for country_code, intensity in FALLBACK_GRID_INTENSITY.items() if country_code != 'default'
+)
+
+# Claims the next batch of metrics without a carbon footprint, oldest first.
+# Reads only the idx_metrics_unprocessed partial index (the processed flag
+# and index are created by the API's migrations), and rows another
+# worker has already claimed are skipped rather than waited on. The row locks
+# last until the cycle commits, and every later step works on exactly these ids.
+CLAIM_BATCH_SQL = f"""
+    SELECT m.id
+    FROM device_metrics m
+    WHERE m.processed = FALSE
+    ORDER BY m.timestamp
+    LIMIT {BATCH_SIZE}
+    FOR UPDATE SKIP LOCKED
+"""
+
+# Distinct rounded locations in the claimed batch ($1, an array of ids) whose
+# grid intensity is missing from (or expired in) grid_intensity_cache
+PENDING_LOCATIONS_SQL = """
+    SELECT DISTINCT l.lat_bucket, l.lon_bucket
+    FROM (
+        SELECT
+            round(latitude::numeric, 1)::float8 as lat_bucket,
+            round(longitude::numeric, 1)::float8 as lon_bucket
+        FROM device_metrics m
+        WHERE m.id = ANY($1) AND latitude IS NOT NULL AND longitude IS NOT NULL
+    ) l
+    LEFT JOIN grid_intensity_cache g
+        ON g.lat_bucket = l.lat_bucket AND g.lon_bucket = l.lon_bucket
+    WHERE g.lat_bucket IS NULL OR g.expires_at <= NOW()
+"""
+
+# Stores freshly fetched intensities; $1 is a JSON array of
+# {lat_bucket, lon_bucket, intensity}
+UPSERT_GRID_INTENSITY_SQL = f"""
+    INSERT INTO grid_intensity_cache (lat_bucket, lon_bucket, intensity, expires_at)
+    SELECT lat_bucket, lon_bucket, intensity, NOW() + interval '{CACHE_TTL_SECONDS} seconds'
+    FROM json_to_recordset($1::json)
+        AS x(lat_bucket FLOAT8, lon_bucket FLOAT8, intensity FLOAT8)
+    ON CONFLICT (lat_bucket, lon_bucket) DO UPDATE
+    SET intensity = EXCLUDED.intensity, expires_at = EXCLUDED.expires_at
+"""
+
+# Computes and stores the footprint of every metric in the claimed batch
+# ($1, an array of ids), pricing each row from the intensity cache
+INSERT_FOOTPRINTS_SQL = f"""
+    WITH batch AS (
+        SELECT m.* FROM device_metrics m WHERE m.id = ANY($1)
+    ),
+    country_intensity(country_code, intensity) AS (
+        VALUES {FALLBACK_INTENSITY_SQL}
+    ),
+    priced AS (
+        SELECT
+            m.id, m.device_id, m.timestamp, m.latitude, m.longitude,
+            COALESCE(m.device_type, 'laptop') as device_type,
+            m.total_power_watts * {MEASUREMENT_INTERVAL_SECONDS} / 3600000.0 as power_kwh,
+            COALESCE(li.intensity, ci.intensity, {FALLBACK_GRID_INTENSITY['default']}) as grid_intensity,
+            COALESCE(dt.embodied_g_per_meas, {EMBODIED_G_PER_MEASUREMENT['laptop']!r}) as embodied_carbon
+        FROM batch m
+        LEFT JOIN grid_intensity_cache li
+            ON li.lat_bucket = round(m.latitude::numeric, 1)::float8
+           AND li.lon_bucket = round(m.longitude::numeric, 1)::float8
+           AND li.expires_at > NOW()
+        LEFT JOIN country_intensity ci ON ci.country_code = m.country_code
+        LEFT JOIN device_types dt ON dt.type = COALESCE(m.device_type, 'laptop')
+    ),
+    footprints AS (
+        SELECT
+            priced.*,
+            power_kwh * grid_intensity as operational_carbon
+        FROM priced
+    ),
+    claimed AS (
+        UPDATE device_metrics SET processed = TRUE
+        FROM batch
+        WHERE device_metrics.id = batch.id
+    )
+    INSERT INTO carbon_footprints
+    (device_id, device_type, metric_id, timestamp,
+     latitude, longitude,
+     power_kwh, grid_intensity_gco2_per_kwh,
+     operational_carbon_gco2, embodied_carbon_gco2,
+     total_carbon_gco2)
+    SELECT
+        device_id, device_type, id, timestamp,
+        latitude, longitude,
+        power_kwh, grid_intensity,
+        operational_carbon, embodied_carbon,
+        operational_carbon + embodied_carbon
+    FROM footprints
+"""
+
 def get_db_connection():
     return psycopg2.connect(**DB_CONFIG)
 
-def init_carbon_table():
-    """Create table for carbon footprint results with IST timezone."""
-    conn = get_db_connection()
+def prepare_session(conn):
+    """
+    PREPARE the per-cycle statements and LISTEN for new metrics on a (new) connection.
+
+    Each cycle then only sends EXECUTE, so the batch query and the
+    INSERT ... SELECT are parsed and planned once per connection.
+    """
     cur = conn.cursor()
+    cur.execute(f"PREPARE claim_batch AS {CLAIM_BATCH_SQL}")
+    cur.execute(f"PREPARE pending_locations (int[]) AS {PENDING_LOCATIONS_SQL}")
+    cur.execute(f"PREPARE upsert_grid_intensity (json) AS {UPSERT_GRID_INTENSITY_SQL}")
+    cur.execute(f"PREPARE insert_footprints (int[]) AS {INSERT_FOOTPRINTS_SQL}")
+    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+    conn.commit()
+    cur.close()
 
-    # Set timezone to IST
-    cur.execute("SET timezone = 'Asia/Kolkata'")
+def wait_for_new_metrics(conn, timeout: float):
+    """Block until the ingest trigger notifies (or `timeout` passes), then drain notifications."""
+    # Notifies raised while the last cycle's transaction was open arrive with
+    # its COMMIT response and are already buffered, leaving the socket idle
+    conn.poll()
+    if not conn.notifies and select.select([conn], [], [], timeout) != ([], [], []):
+        conn.poll()
+    conn.notifies.clear()
+
+def init_carbon_table(conn):
+    """Create table for carbon footprint results with IST timezone."""
+    cur = conn.cursor()
 
     cur.execute("""
         CREATE TABLE IF NOT EXISTS carbon_footprints (
@@ -82,10 +244,8 @@ def init_carbon_table():
             grid_intensity_gco2_per_kwh FLOAT NOT NULL,
             operational_carbon_gco2 FLOAT NOT NULL,
 
-            -- Embodied emissions (amortized)
+            -- Embodied emissions (amortized; device totals live in device_types)
             embodied_carbon_gco2 FLOAT NOT NULL,
-            embodied_total_kgco2e FLOAT,
-            device_lifetime_years FLOAT,
 
             -- Total emissions
             total_carbon_gco2 FLOAT NOT NULL,
@@ -94,6 +254,63 @@ def init_carbon_table():
         )
     """)
 
+    # Per-type embodied carbon and lifetime, stored once instead of on every
+    # footprint row; re-seeded on startup so constant changes take effect
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS device_types (
+            type TEXT PRIMARY KEY,
+            embodied_kg FLOAT NOT NULL,
+            lifetime_years FLOAT NOT NULL,
+            embodied_g_per_meas FLOAT NOT NULL
+        )
+    """)
+
+    cur.execute(f"""
+        INSERT INTO device_types (type, embodied_kg, lifetime_years, embodied_g_per_meas)
+        VALUES {DEVICE_TYPES_SQL}
+        ON CONFLICT (type) DO UPDATE
+        SET embodied_kg = EXCLUDED.embodied_kg,
+            lifetime_years = EXCLUDED.lifetime_years,
+            embodied_g_per_meas = EXCLUDED.embodied_g_per_meas
+    """)
+
+    # Footprint tables from before device_types carried both values per row;
+    # mv_carbon_by_device depends on them, so it is rebuilt below
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'carbon_footprints' AND column_name = 'embodied_total_kgco2e'
+    """)
+    if cur.fetchone() is not None:
+        cur.execute("DROP MATERIALIZED VIEW IF EXISTS mv_carbon_by_device")
+        cur.execute("""
+            ALTER TABLE carbon_footprints
+            DROP COLUMN embodied_total_kgco2e,
+            DROP COLUMN device_lifetime_years
+        """)
+
+    # Footprints with their device type's totals, as the table used to store them
+    cur.execute(f"""
+        CREATE OR REPLACE VIEW carbon_footprints_full AS
+        SELECT
+            c.*,
+            COALESCE(d.embodied_kg, {EMBODIED_CARBON_KG['laptop']}) as embodied_total_kgco2e,
+            COALESCE(d.lifetime_years, {EXPECTED_LIFETIME_YEARS['laptop']}) as device_lifetime_years
+        FROM carbon_footprints c
+        LEFT JOIN device_types d ON d.type = c.device_type
+    """)
+
+    # Grid intensity per rounded location, kept across restarts and shared
+    # by every worker replica
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS grid_intensity_cache (
+            lat_bucket FLOAT NOT NULL,
+            lon_bucket FLOAT NOT NULL,
+            intensity FLOAT NOT NULL,
+            expires_at TIMESTAMPTZ NOT NULL,
+            PRIMARY KEY (lat_bucket, lon_bucket)
+        )
+    """)
+
     cur.execute("""
         CREATE INDEX IF NOT EXISTS idx_carbon_device
         ON carbon_footprints(device_id)
@@ -104,11 +321,115 @@ def init_carbon_table():
         ON carbon_footprints(timestamp)
     """)
 
+    # Covers /carbon/device/<id>: index-only scan in timestamp DESC order
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_cf_device_ts
+        ON carbon_footprints(device_id, timestamp DESC)
+        INCLUDE (power_kwh, grid_intensity_gco2_per_kwh, operational_carbon_gco2,
+                 embodied_carbon_gco2, total_carbon_gco2, calculated_at)
+    """)
+
+    # /carbon/by-hour reads mv_carbon_by_hour, whose refresh is a full GROUP BY,
+    # so this expression index only slowed every footprint insert
+    cur.execute("DROP INDEX IF EXISTS idx_cf_hour_ist")
+
+    # Pre-aggregated hourly breakdown served by /carbon/by-hour
+    cur.execute("""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS mv_carbon_by_hour AS
+        SELECT
+            EXTRACT(HOUR FROM timestamp AT TIME ZONE 'Asia/Kolkata') as hour,
+            COUNT(*) as measurement_count,
+            AVG(grid_intensity_gco2_per_kwh) as avg_grid_intensity,
+            SUM(operational_carbon_gco2) as total_operational_g,
+            SUM(embodied_carbon_gco2) as total_embodied_g,
+            SUM(total_carbon_gco2) as total_carbon_g
+        FROM carbon_footprints
+        GROUP BY 1
+    """)
+
+    # REFRESH ... CONCURRENTLY requires a unique index
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_carbon_by_hour
+        ON mv_carbon_by_hour(hour)
+    """)
+
+    # Pre-aggregated per-device totals served by /carbon/by-device
+    cur.execute("""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS mv_carbon_by_device AS
+        SELECT
+            device_id,
+            device_type,
+            COUNT(*) as measurement_count,
+            SUM(operational_carbon_gco2) as total_operational_g,
+            SUM(embodied_carbon_gco2) as total_embodied_g,
+            SUM(total_carbon_gco2) as total_carbon_g,
+            AVG(embodied_total_kgco2e) as avg_embodied_total_kg,
+            MIN(timestamp) as first_seen,
+            MAX(timestamp) as last_seen
+        FROM carbon_footprints_full
+        GROUP BY device_id, device_type
+    """)
+
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_carbon_by_device
+        ON mv_carbon_by_device(device_id, device_type) NULLS NOT DISTINCT
+    """)
+
+    # Single-row overall totals served by /carbon/summary
+    cur.execute("""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS mv_carbon_summary AS
+        SELECT
+            1 as singleton,
+            COUNT(*) as total_measurements,
+            SUM(operational_carbon_gco2) as total_operational_g,
+            SUM(embodied_carbon_gco2) as total_embodied_g,
+            SUM(total_carbon_gco2) as total_carbon_g,
+            AVG(total_carbon_gco2) as avg_carbon_per_measurement,
+            SUM(power_kwh) as total_energy_kwh,
+            COUNT(DISTINCT device_id) as unique_devices
+        FROM carbon_footprints
+    """)
+
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_carbon_summary
+        ON mv_carbon_summary(singleton)
+    """)
+
     conn.commit()
     cur.close()
-    conn.close()
     print("Carbon footprint table initialized (Timezone: Asia/Kolkata)")
 
+def refresh_materialized_views(conn):
+    """Refresh the aggregate views without blocking API readers."""
+    cur = conn.cursor()
+    cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY mv_carbon_by_hour")
+    cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY mv_carbon_by_device")
+    cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY mv_carbon_summary")
+    conn.commit()
+    cur.close()
+
+def refresh_views_loop(views_stale: threading.Event):
+    """
+    Refresh the aggregate views on a dedicated connection whenever the
+    processing loop flags new footprints, at most every MV_REFRESH_INTERVAL_SECONDS.
+    """
+    conn = None
+    while True:
+        views_stale.wait()
+        try:
+            if conn is None:
+                conn = get_db_connection()
+            # Cleared first, so footprints written during the refresh flag the next one
+            views_stale.clear()
+            refresh_materialized_views(conn)
+        except psycopg2.Error as e:
+            print(f"View refresh failed: {e}")
+            views_stale.set()
+            if conn is not None:
+                conn.close()
+            conn = None
+        time.sleep(MV_REFRESH_INTERVAL_SECONDS)
+
 def fetch_grid_intensity_by_location(lat: float, lon: float) -> Optional[float]:
     """
     Fetch real-time grid carbon intensity using lat/lon.
@@ -127,7 +448,7 @@ def fetch_grid_intensity_by_location(lat: float, lon: float) -> Optional[float]:
         headers = {'auth-token': ELECTRICITY_MAPS_TOKEN}
         params = {'lat': lat, 'lon': lon, 'temporalGranularity':'5_minutes'}
 
-        response = requests.get(
+        response = _SESSION.get(
             ELECTRICITY_MAPS_API,
             headers=headers,
             params=params,
@@ -155,155 +476,53 @@ def fetch_grid_intensity_by_location(lat: float, lon: float) -> Optional[float]:
         print(f"Error parsing API response: {e}")
         return None
 
-def get_grid_intensity_with_cache(lat: float, lon: float, country_code: str = None) -> float:
+def process_unprocessed_metrics(conn):
     """
-    Get grid intensity with location-based caching.
-
-    Args:
-        lat: Latitude
-        lon: Longitude
-        country_code: ISO country code for fallback
+    Find and process metrics that haven't been profiled yet (IST timezone).
 
-    Returns:
-        Carbon intensity in gCO2eq/kWh
+    Only the grid intensity lookups (Electricity Maps, per rounded location
+    not already in grid_intensity_cache) happen in Python; every footprint
+    column is then computed and inserted by a single INSERT ... SELECT.
     """
-    # Create cache key (rounded to 1 decimal for nearby locations)
-    cache_key = f"{round(lat, 1)}_{round(lon, 1)}"
-    now = time.time()
-
-    # Check cache
-    if cache_key in grid_intensity_cache:
-        cached_data = grid_intensity_cache[cache_key]
-        if now - cached_data['timestamp'] < CACHE_TTL_SECONDS:
-            return cached_data['value']
-
-    # Try to fetch fresh data
-    intensity = fetch_grid_intensity_by_location(lat, lon)
-
-    if intensity is not None:
-        # Update cache
-        grid_intensity_cache[cache_key] = {
-            'value': intensity,
-            'timestamp': now
-        }
-        return intensity
-    else:
-        # Use regional fallback
-        fallback = FALLBACK_GRID_INTENSITY.get(
-            country_code,
-            FALLBACK_GRID_INTENSITY['default']
-        )
-        print(f"Using fallback intensity: {fallback} gCO2/kWh ({country_code or 'default'})")
-        return fallback
-
-def calculate_embodied_carbon_per_measurement(device_type: str, measurement_interval_seconds: int = 5) -> float:
-    """Calculate amortized embodied carbon per measurement period."""
-    embodied_total_kg = EMBODIED_CARBON_KG.get(device_type, EMBODIED_CARBON_KG["laptop"])
-    lifetime_years = EXPECTED_LIFETIME_YEARS.get(device_type, EXPECTED_LIFETIME_YEARS["laptop"])
-
-    total_lifetime_seconds = lifetime_years * 365 * 24 * 3600
-    total_measurements = total_lifetime_seconds / measurement_interval_seconds
-    embodied_per_measurement_g = (embodied_total_kg * 1000) / total_measurements
-
-    return embodied_per_measurement_g
-
-def process_unprocessed_metrics():
-    """Find and process metrics that haven't been profiled yet (IST timezone)."""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-
-    # Set timezone to IST
-    cur.execute("SET timezone = 'Asia/Kolkata'")
-
-    # Find unprocessed metrics WITH location data
-    cur.execute("""
-        SELECT
-            m.id, m.device_id, m.device_type, m.timestamp,
-            m.total_power_watts, m.latitude, m.longitude,
-            m.country_code
-        FROM device_metrics m
-        LEFT JOIN carbon_footprints c ON m.id = c.metric_id
-        WHERE c.id IS NULL
-        ORDER BY m.timestamp
-        LIMIT 100
-    """)
-
-    unprocessed = cur.fetchall()
+    cur = conn.cursor()
 
-    if not unprocessed:
+    # Lock the batch once; rows ingested while the lookups below run wait
+    # for the next cycle instead of joining the insert unpriced
+    cur.execute("EXECUTE claim_batch")
+    batch_ids = [row[0] for row in cur.fetchall()]
+    if not batch_ids:
+        conn.commit()
         cur.close()
-        conn.close()
         return 0
 
-    processed_count = 0
-
-    for metric in unprocessed:
-        device_type = metric['device_type'] or 'laptop'
-        lat = metric.get('latitude')
-        lon = metric.get('longitude')
-        country_code = metric.get('country_code')
+    # Locations in the claimed batch with no live cache entry
+    cur.execute("EXECUTE pending_locations (%s)", (batch_ids,))
 
-        # Get location-aware grid intensity
-        if lat is not None and lon is not None:
-            grid_intensity = get_grid_intensity_with_cache(lat, lon, country_code)
-        else:
-            # No location data - use country fallback
-            grid_intensity = FALLBACK_GRID_INTENSITY.get(
-                country_code,
-                FALLBACK_GRID_INTENSITY['default']
-            )
-            print(f"No location for metric {metric['id']}, using fallback: {grid_intensity}")
-
-        # === OPERATIONAL CARBON ===
-        power_kwh = (metric['total_power_watts'] * 5) / (1000 * 3600)
-        operational_carbon_gco2 = power_kwh * grid_intensity
-
-        # === EMBODIED CARBON ===
-        embodied_carbon_gco2 = calculate_embodied_carbon_per_measurement(
-            device_type=device_type,
-            measurement_interval_seconds=5
-        )
+    missing = cur.fetchall()
 
-        embodied_total_kg = EMBODIED_CARBON_KG.get(device_type, EMBODIED_CARBON_KG["laptop"])
-        device_lifetime = EXPECTED_LIFETIME_YEARS.get(device_type, EXPECTED_LIFETIME_YEARS["laptop"])
+    # Fetch them concurrently rather than one blocking request at a time
+    fetched = []
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(missing))) as executor:
+            intensities = executor.map(lambda loc: fetch_grid_intensity_by_location(*loc), missing)
+            for (lat_bucket, lon_bucket), intensity in zip(missing, intensities):
+                if intensity is not None:
+                    fetched.append({'lat_bucket': lat_bucket, 'lon_bucket': lon_bucket, 'intensity': intensity})
 
-        # === TOTAL CARBON ===
-        total_carbon_gco2 = operational_carbon_gco2 + embodied_carbon_gco2
+    if fetched:
+        cur.execute("EXECUTE upsert_grid_intensity (%s)", (json.dumps(fetched),))
 
-        # Store the result (timestamp will be stored in IST)
-        cur.execute("""
-            INSERT INTO carbon_footprints
-            (device_id, device_type, metric_id, timestamp,
-             latitude, longitude,
-             power_kwh, grid_intensity_gco2_per_kwh,
-             operational_carbon_gco2, embodied_carbon_gco2,
-             embodied_total_kgco2e, device_lifetime_years,
-             total_carbon_gco2)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            metric['device_id'],
-            device_type,
-            metric['id'],
-            metric['timestamp'],
-            lat,
-            lon,
-            power_kwh,
-            grid_intensity,
-            operational_carbon_gco2,
-            embodied_carbon_gco2,
-            embodied_total_kg,
-            device_lifetime,
-            total_carbon_gco2
-        ))
-
-        processed_count += 1
+    # Rows without a location (or whose fetch failed) fall back to the
+    # country average, then the global default
+    cur.execute("EXECUTE insert_footprints (%s)", (batch_ids,))
+    processed_count = cur.rowcount
 
     conn.commit()
     cur.close()
-    conn.close()
 
-    ist_time = datetime.now(IST).strftime('%H:%M:%S IST')
-    print(f"Processed {processed_count} metrics at {ist_time}")
+    if processed_count:
+        ist_time = datetime.now(IST).strftime('%H:%M:%S IST')
+        print(f"Processed {processed_count} metrics at {ist_time}")
     return processed_count
 
 def main():
@@ -329,7 +548,9 @@ def main():
 
     # Initialize carbon table
     try:
-        init_carbon_table()
+        conn = get_db_connection()
+        init_carbon_table(conn)
+        prepare_session(conn)
     except Exception as e:
         print(f"Error initializing: {e}")
         time.sleep(10)
@@ -337,16 +558,48 @@ def main():
 
     print(f"\n🚀 Starting processing loop at {datetime.now(IST).strftime('%H:%M:%S IST')}...\n")
 
-    # Process loop
+    # View refreshes run beside the processing loop instead of stalling it
+    views_stale = threading.Event()
+    threading.Thread(target=refresh_views_loop, args=(views_stale,), daemon=True).start()
+
+    # Process loop on one long-lived connection, reopened only after it breaks
     while True:
         try:
-            process_unprocessed_metrics()
-            time.sleep(10)
+            if conn is None:
+                conn = get_db_connection()
+                try:
+                    prepare_session(conn)
+                except Exception:
+                    # A rollback keeps the PREPAREs that succeeded, and the
+                    # session would never be set up again; start over instead
+                    conn.close()
+                    conn = None
+                    raise
+
+            processed_count = process_unprocessed_metrics(conn)
+            if processed_count:
+                views_stale.set()
+
+            # A full batch means a backlog: go straight to the next one
+            if processed_count < BATCH_SIZE:
+                wait_for_new_metrics(conn, NOTIFY_TIMEOUT_SECONDS)
         except KeyboardInterrupt:
             print("\n Worker stopped by user")
             break
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            print(f"Database connection lost, reconnecting: {e}")
+            if conn is not None:
+                conn.close()
+            conn = None
+            time.sleep(10)
         except Exception as e:
             print(f"Error: {e}")
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    conn.close()
+                    conn = None
             time.sleep(10)
 
 if __name__ == "__main__":
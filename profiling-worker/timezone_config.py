@@ -6,85 +6,66 @@ Reads timezone from environment or uses system default
 import os
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from typing import Optional
+
+
+def _resolve_timezone() -> tuple:
+    """
+    Resolve the backend timezone once, at import.
+    Priority:
+    1. APP_TIMEZONE environment variable
+    2. TZ environment variable
+    3. UTC (safe default for servers)
+    """
+    tz_name = os.environ.get('APP_TIMEZONE') or os.environ.get('TZ') or 'UTC'
+
+    try:
+        return tz_name, ZoneInfo(tz_name)
+    except Exception as e:
+        print(f"⚠️  Invalid timezone '{tz_name}', using UTC: {e}")
+        return "UTC", ZoneInfo("UTC")
+
+
+_TZ_NAME, _TZ = _resolve_timezone()
 
 
 class BackendTimezone:
     """Manage timezone for backend services (API, Worker)."""
 
-    _timezone = None
-    _timezone_name = None
-
     @classmethod
     def get_timezone(cls) -> ZoneInfo:
-        """
-        Get timezone for backend operations.
-        Priority:
-        1. APP_TIMEZONE environment variable
-        2. TZ environment variable
-        3. UTC (safe default for servers)
-        """
-        if cls._timezone is not None:
-            return cls._timezone
-
-        tz_name = cls.get_timezone_name()
-
-        try:
-            cls._timezone = ZoneInfo(tz_name)
-            return cls._timezone
-        except Exception as e:
-            print(f"⚠️  Invalid timezone '{tz_name}', using UTC: {e}")
-            cls._timezone = ZoneInfo("UTC")
-            cls._timezone_name = "UTC"
-            return cls._timezone
+        """Get timezone for backend operations."""
+        return _TZ
 
     @classmethod
     def get_timezone_name(cls) -> str:
         """Get timezone name from environment."""
-        if cls._timezone_name is not None:
-            return cls._timezone_name
-
-        # Priority 1: APP_TIMEZONE (our custom variable)
-        tz_name = os.environ.get('APP_TIMEZONE')
-        if tz_name:
-            cls._timezone_name = tz_name
-            return tz_name
-
-        # Priority 2: TZ (standard Unix variable)
-        tz_name = os.environ.get('TZ')
-        if tz_name:
-            cls._timezone_name = tz_name
-            return tz_name
-
-        # Default: UTC (safe for servers)
-        cls._timezone_name = "UTC"
-        return "UTC"
+        return _TZ_NAME
 
     @classmethod
     def now(cls) -> datetime:
         """Get current time in configured timezone."""
-        return datetime.now(cls.get_timezone())
+        return datetime.now(_TZ)
 
     @classmethod
     def get_postgres_timezone(cls) -> str:
         """Get PostgreSQL-compatible timezone string."""
-        return cls.get_timezone_name()
+        return _TZ_NAME
 
 
 # Convenience functions
 def get_tz() -> ZoneInfo:
     """Get configured timezone."""
-    return BackendTimezone.get_timezone()
+    return _TZ
 
 
 def get_tz_name() -> str:
     """Get timezone name."""
-    return BackendTimezone.get_timezone_name()
+    return _TZ_NAME
 
 
 def now_tz() -> datetime:
     """Get current time in configured timezone."""
-    return BackendTimezone.now()
+    return datetime.now(_TZ)
 
 
 def get_display_name() -> str: